@@ -1,4 +1,13 @@
 from django.contrib import admin
-from .models import LessonPlan
+from .models import LessonPlan, PlanUsageStat
 
 admin.site.register(LessonPlan)
+
+
+@admin.register(PlanUsageStat)
+class PlanUsageStatAdmin(admin.ModelAdmin):
+    list_display = ("subject", "grade", "month", "plan_count", "average_duration")
+    list_filter = ("subject", "grade")
+    date_hierarchy = "month"
+    # maintained by signals; edit through rebuild_usage_stats rather than by hand
+    readonly_fields = ("subject", "grade", "month", "plan_count", "total_duration")
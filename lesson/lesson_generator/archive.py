@@ -0,0 +1,255 @@
+"""Cold storage for old lesson plans.
+
+Archived plans are written to append-only segment files in ARCHIVE_DIR:
+
+- ``plans-<first_id>-<last_id>.jsonl.gz`` holds one JSON record per plan,
+  compressed in blocks of BLOCK_RECORDS records. Every block is its own gzip
+  member, so the whole file is still a valid gzip stream (``zcat`` prints
+  JSONL) while any single block can be decompressed on its own. Templated
+  plan bodies repeat a lot, so blocks compress far better than single records.
+- ``plans-<first_id>-<last_id>.idx`` is a sorted array of fixed-size
+  ``(id, block offset, block length, ordinal)`` entries, binary searched to
+  find a record; ``ordinal`` is the record's line within its block.
+- ``plans-<first_id>-<last_id>.uidx`` holds the same entries keyed and sorted
+  by user id, so one user's records can be read without touching the rest.
+
+A lookup therefore reads a few index entries plus one compressed block,
+independent of how many plans have been archived.
+"""
+import datetime
+import gzip
+import itertools
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+
+from django.conf import settings
+from django.db import models
+
+from .models import LessonPlan
+
+INDEX_ENTRY = struct.Struct('<QQII')  # plan or user id, block offset, block length, ordinal
+BLOCK_RECORDS = 64
+FILE_MODE = 0o644  # readable by the web server when archiving runs as another user
+SEGMENT_SUFFIX = '.jsonl.gz'
+INDEX_SUFFIX = '.idx'
+USER_INDEX_SUFFIX = '.uidx'
+
+_SEGMENT_RE = re.compile(r'^plans-(\d+)-(\d+)(?:\.\d+)?\.jsonl\.gz$')
+
+
+def archive_dir():
+    return str(getattr(settings, 'ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'archive')))
+
+
+def _segments():
+    """Return ``(first_id, last_id, base_path)`` for every complete segment."""
+    directory = archive_dir()
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    segments = []
+    for name in names:
+        m = _SEGMENT_RE.match(name)
+        if not m:
+            continue
+        base = os.path.join(directory, name[:-len(SEGMENT_SUFFIX)])
+        # the index is renamed into place last, so its presence marks a finished segment
+        if os.path.exists(base + INDEX_SUFFIX):
+            segments.append((int(m.group(1)), int(m.group(2)), base))
+    return sorted(segments)
+
+
+def plan_to_record(plan):
+    """Serialize every concrete LessonPlan field to a JSON-safe dict."""
+    record = {}
+    for field in LessonPlan._meta.concrete_fields:
+        value = field.value_from_object(plan)
+        if isinstance(value, (datetime.datetime, datetime.date)):
+            value = value.isoformat()
+        record[field.attname] = value
+    return record
+
+
+def record_to_plan(record):
+    """Build an unsaved LessonPlan instance from an archived record."""
+    values = {}
+    for field in LessonPlan._meta.concrete_fields:
+        if field.attname not in record:
+            continue
+        value = record[field.attname]
+        if value is not None and isinstance(field, models.DateTimeField):
+            value = datetime.datetime.fromisoformat(value)
+        values[field.attname] = value
+    return LessonPlan(**values)
+
+
+def _find_entry(index_path, pk):
+    """Binary search a segment index for ``pk``; return (offset, length, ordinal) or None."""
+    with open(index_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < INDEX_ENTRY.size:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            lo, hi = 0, size // INDEX_ENTRY.size - 1
+            while lo <= hi:
+                mid = (lo + hi) // 2
+                entry_id, offset, length, ordinal = INDEX_ENTRY.unpack_from(mm, mid * INDEX_ENTRY.size)
+                if entry_id == pk:
+                    return offset, length, ordinal
+                if entry_id < pk:
+                    lo = mid + 1
+                else:
+                    hi = mid - 1
+    return None
+
+
+def _user_entries(user_index_path, user_id):
+    """Return ``(offset, length, ordinal)`` of every record of ``user_id`` in a segment, in id order."""
+    with open(user_index_path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < INDEX_ENTRY.size:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count = size // INDEX_ENTRY.size
+            # lower bound of user_id
+            lo, hi = 0, count
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if INDEX_ENTRY.unpack_from(mm, mid * INDEX_ENTRY.size)[0] < user_id:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            entries = []
+            for i in range(lo, count):
+                entry_user, offset, length, ordinal = INDEX_ENTRY.unpack_from(mm, i * INDEX_ENTRY.size)
+                if entry_user != user_id:
+                    break
+                entries.append((offset, length, ordinal))
+            return entries
+
+
+def _read_block(f, offset, length):
+    f.seek(offset)
+    return gzip.decompress(f.read(length)).splitlines()
+
+
+def load_plan(pk):
+    """Return the archived LessonPlan with primary key ``pk``, or None."""
+    for first_id, last_id, base in _segments():
+        if not first_id <= pk <= last_id:
+            continue
+        found = _find_entry(base + INDEX_SUFFIX, pk)
+        if found is None:
+            continue
+        offset, length, ordinal = found
+        with open(base + SEGMENT_SUFFIX, 'rb') as f:
+            return record_to_plan(json.loads(_read_block(f, offset, length)[ordinal]))
+    return None
+
+
+def archived_ids(ids):
+    """Return the subset of ``ids`` already stored in a finished segment."""
+    found = set()
+    for first_id, last_id, base in _segments():
+        for pk in ids:
+            if first_id <= pk <= last_id and pk not in found and _find_entry(base + INDEX_SUFFIX, pk):
+                found.add(pk)
+    return found
+
+
+def iter_plans():
+    """Yield every archived plan, one segment at a time, in constant memory."""
+    for first_id, last_id, base in _segments():
+        with gzip.open(base + SEGMENT_SUFFIX, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    yield record_to_plan(json.loads(line))
+
+
+def iter_user_plans(user_id):
+    """Yield one user's archived plans, decompressing only the blocks that hold them."""
+    for first_id, last_id, base in _segments():
+        entries = _user_entries(base + USER_INDEX_SUFFIX, user_id)
+        if not entries:
+            continue
+        with open(base + SEGMENT_SUFFIX, 'rb') as f:
+            block_offset, lines = None, None
+            for offset, length, ordinal in entries:
+                # entries are in id order, so records of one block are adjacent
+                if offset != block_offset:
+                    block_offset, lines = offset, _read_block(f, offset, length)
+                yield record_to_plan(json.loads(lines[ordinal]))
+
+
+def _write_temp(directory, prefix, chunks):
+    """Write ``chunks`` to a new temporary file in ``directory`` and return its path."""
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix='.tmp', dir=directory)
+    with os.fdopen(fd, 'wb') as out:
+        for chunk in chunks:
+            out.write(chunk)
+        out.flush()
+        os.fsync(out.fileno())
+    # mkstemp creates files as 0600
+    os.chmod(path, FILE_MODE)
+    return path
+
+
+def _blocks(plans, entries):
+    """Yield gzip members of up to BLOCK_RECORDS plans each.
+
+    Appends ``(id, user id, block offset, block length, ordinal)`` to
+    ``entries`` for every plan written.
+    """
+    plans = iter(plans)
+    offset = 0
+    while True:
+        block = list(itertools.islice(plans, BLOCK_RECORDS))
+        if not block:
+            return
+        blob = gzip.compress(
+            b''.join(json.dumps(plan_to_record(plan), ensure_ascii=False).encode('utf-8') + b'\n' for plan in block),
+            mtime=0,
+        )
+        entries.extend(
+            (plan.pk, plan.user_id or 0, offset, len(blob), ordinal) for ordinal, plan in enumerate(block)
+        )
+        offset += len(blob)
+        yield blob
+
+
+def write_segment(plans):
+    """Write ``plans`` (ordered by id) to a new segment and return its base path.
+
+    Files are written under temporary names and renamed into place, index
+    last, so readers never see a partial segment.
+    """
+    directory = archive_dir()
+    os.makedirs(directory, exist_ok=True)
+    entries = []
+    tmp_data = _write_temp(directory, '.segment-', _blocks(plans, entries))
+    if not entries:
+        os.remove(tmp_data)
+        return None
+
+    entries.sort()
+    base = os.path.join(directory, f'plans-{entries[0][0]:012d}-{entries[-1][0]:012d}')
+    if os.path.exists(base + SEGMENT_SUFFIX):
+        # never overwrite a finished segment
+        n = 1
+        while os.path.exists(f'{base}.{n}{SEGMENT_SUFFIX}'):
+            n += 1
+        base = f'{base}.{n}'
+    by_id = (INDEX_ENTRY.pack(pk, *block) for pk, _, *block in entries)
+    by_user = (INDEX_ENTRY.pack(user_id, *block) for _, user_id, *block in sorted(entries, key=lambda e: (e[1], e[0])))
+    tmp_user_index = _write_temp(directory, '.index-', by_user)
+    tmp_index = _write_temp(directory, '.index-', by_id)
+    os.replace(tmp_data, base + SEGMENT_SUFFIX)
+    os.replace(tmp_user_index, base + USER_INDEX_SUFFIX)
+    # the id index goes last: its presence marks the segment as complete
+    os.replace(tmp_index, base + INDEX_SUFFIX)
+    return base
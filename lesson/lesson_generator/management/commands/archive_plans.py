@@ -0,0 +1,82 @@
+"""Move old lesson plans out of the LessonPlan table into compressed segments.
+
+Examples::
+
+    python manage.py archive_plans --before 2025-01-01
+    python manage.py archive_plans --older-than-days 365 --dry-run
+    python manage.py archive_plans --before 2025-01-01 --vacuum
+"""
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from lesson_generator import archive, stats
+from lesson_generator.models import LessonPlan
+
+DELETE_CHUNK = 500
+
+
+class Command(BaseCommand):
+    help = 'Archive lesson plans created before a cutoff into compressed JSONL segments.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive plans created before this date (YYYY-MM-DD).')
+        parser.add_argument('--older-than-days', type=int, help='Archive plans older than this many days.')
+        parser.add_argument('--segment-size', type=int, default=10000, help='Maximum plans per segment file (default: 10000).')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many plans would be archived.')
+        parser.add_argument('--vacuum', action='store_true', help='Run VACUUM afterwards so SQLite returns the freed space.')
+
+    def _cutoff(self, options):
+        if bool(options['before']) == (options['older_than_days'] is not None):
+            raise CommandError('Pass exactly one of --before or --older-than-days.')
+        if options['before']:
+            try:
+                day = datetime.date.fromisoformat(options['before'])
+            except ValueError:
+                raise CommandError('--before must be a date in YYYY-MM-DD format.')
+            return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+        return timezone.now() - datetime.timedelta(days=options['older_than_days'])
+
+    def handle(self, *args, **options):
+        cutoff = self._cutoff(options)
+        if options['segment_size'] < 1:
+            raise CommandError('--segment-size must be at least 1.')
+
+        candidates = LessonPlan.objects.filter(created__lt=cutoff).order_by('pk')
+        total = candidates.count()
+        if options['dry_run'] or not total:
+            self.stdout.write(f'{total} lesson plans created before {cutoff:%Y-%m-%d %H:%M} would be archived.')
+            return
+
+        archived = 0
+        last_pk = 0
+        while True:
+            batch = list(candidates.filter(pk__gt=last_pk)[:options['segment_size']])
+            if not batch:
+                break
+            ids = [plan.pk for plan in batch]
+            # a run that died after writing a segment left its rows behind: they are
+            # already archived, so only delete them instead of writing them twice
+            done = archive.archived_ids(ids)
+            fresh = [plan for plan in batch if plan.pk not in done]
+            base = archive.write_segment(fresh) if fresh else None
+            # rows are only removed once their segment is safely on disk; archived
+            # plans still count towards the usage statistics
+            with transaction.atomic(), stats.suspended():
+                # chunked to stay under SQLite's bound-parameter limit
+                for i in range(0, len(ids), DELETE_CHUNK):
+                    LessonPlan.objects.filter(pk__in=ids[i:i + DELETE_CHUNK]).delete()
+            archived += len(ids)
+            last_pk = ids[-1]
+            if base:
+                self.stdout.write(f'Archived {len(fresh)} plans to {base}{archive.SEGMENT_SUFFIX}')
+            if done:
+                self.stdout.write(f'Removed {len(done)} plans that were already archived')
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} lesson plans.'))
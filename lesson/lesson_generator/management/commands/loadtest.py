@@ -0,0 +1,435 @@
+"""Concurrent load generator for the lesson planner.
+
+Drives either the in-process WSGI application (``lesson_planner.wsgi.application``)
+or a running server (``--url``) with a weighted mix of login, generate,
+dashboard and download requests, then reports throughput, latency percentiles,
+error rates and SQLite lock waits.
+
+Examples::
+
+    python manage.py loadtest --threads 8 --requests 200
+    python manage.py loadtest --processes 2 --threads 4 --mix dashboard=6,generate=2,download=2
+    python manage.py loadtest --url http://127.0.0.1:8000 --threads 16 --duration 30
+"""
+import io
+import multiprocessing
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from lesson_generator.models import LessonPlan
+
+DEFAULT_MIX = 'login=1,generate=2,dashboard=5,download=2'
+ACTIONS = ('login', 'generate', 'dashboard', 'download')
+
+_CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="([^"]+)"')
+_PLAN_RE = re.compile(r'/lesson/(\d+)/pdf/')
+
+SAMPLE_TOPICS = [
+    ('Mathematics', 'Grade 7', 'Fractions and decimals'),
+    ('Mathematics', 'Grade 9', 'Linear equations'),
+    ('Science', 'Grade 8', 'Chemistry lab safety'),
+    ('Computer Science', 'Grade 10', 'Python loops'),
+    ('History', 'Grade 6', 'Ancient civilisations'),
+]
+
+
+def percentile(sorted_values, pct):
+    """Return the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(pct / 100.0 * len(sorted_values))))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def parse_mix(spec):
+    """Parse ``'login=1,generate=2'`` into a list of (action, weight) pairs."""
+    mix = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in ACTIONS:
+            raise CommandError(f"Unknown action '{name}' in --mix (expected one of {', '.join(ACTIONS)}).")
+        try:
+            weight = int(weight or 1)
+        except ValueError:
+            raise CommandError(f"Weight for '{name}' must be an integer.")
+        if weight > 0:
+            mix.append((name, weight))
+    if not mix:
+        raise CommandError('--mix must contain at least one action with a positive weight.')
+    return mix
+
+
+class WSGIClient:
+    """Minimal cookie-aware client calling a WSGI callable directly.
+
+    Unlike django.test.Client this goes through the real project application,
+    so every middleware and the request_started/finished signals run as they
+    would behind a WSGI server.
+    """
+
+    def __init__(self, application):
+        self.application = application
+        self.cookies = {}
+        self.location = ''
+
+    def request(self, method, path, data=None):
+        path, _, query = path.partition('?')
+        body = urllib.parse.urlencode(data).encode('utf-8') if data else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': query,
+            'SCRIPT_NAME': '',
+            'SERVER_NAME': '127.0.0.1',
+            'SERVER_PORT': '80',
+            'SERVER_PROTOCOL': 'HTTP/1.1',
+            'HTTP_HOST': '127.0.0.1',
+            'REMOTE_ADDR': '127.0.0.1',
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': 'http',
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+            'CONTENT_LENGTH': str(len(body)),
+        }
+        if data:
+            environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+        if self.cookies:
+            environ['HTTP_COOKIE'] = '; '.join(f'{k}={v}' for k, v in self.cookies.items())
+
+        captured = {}
+
+        def start_response(status, headers, exc_info=None):
+            captured['status'] = int(status.split(' ', 1)[0])
+            captured['headers'] = headers
+
+        result = self.application(environ, start_response)
+        try:
+            content = b''.join(result)
+        finally:
+            # close() fires request_finished, which releases the DB connection
+            if hasattr(result, 'close'):
+                result.close()
+
+        self.location = ''
+        for name, value in captured.get('headers', []):
+            if name.lower() == 'location':
+                self.location = value
+            elif name.lower() == 'set-cookie':
+                cookie = SimpleCookie()
+                cookie.load(value)
+                for key, morsel in cookie.items():
+                    self.cookies[key] = morsel.value
+        return captured.get('status', 0), content
+
+
+class HTTPClient:
+    """Cookie-aware client for a live server that does not follow redirects."""
+
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(), self._NoRedirect()
+        )
+        self.location = ''
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if body is not None:
+            req.add_header('Referer', self.base_url + path)
+        try:
+            with self.opener.open(req, timeout=60) as resp:
+                self.location = resp.headers.get('Location', '')
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            # unfollowed redirects end up here too
+            self.location = e.headers.get('Location', '')
+            return e.code, e.read()
+
+
+class LockMonitor:
+    """Query execute wrapper that records SQLite lock contention.
+
+    SQLite waits inside the busy handler before raising ``database is locked``,
+    so the wait shows up as execution time of write statements. Writes slower
+    than ``threshold`` seconds are counted as lock waits, and lock errors are
+    counted separately.
+    """
+
+    WRITE_PREFIXES = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE', 'BEGIN', 'SAVEPOINT', 'RELEASE')
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.waits = 0
+        self.wait_time = 0.0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        except Exception as e:
+            if 'locked' in str(e).lower():
+                with self._lock:
+                    self.errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold and sql.lstrip()[:9].upper().startswith(self.WRITE_PREFIXES):
+                with self._lock:
+                    self.waits += 1
+                    self.wait_time += elapsed
+
+
+class Worker:
+    """One simulated user: logs in once, then issues weighted random actions."""
+
+    def __init__(self, client, username, password, mix, seed):
+        self.client = client
+        self.username = username
+        self.password = password
+        self.rng = random.Random(seed)
+        self.actions = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.plan_ids = []
+        self.logged_in = False
+        self.samples = []  # (action, seconds, status, ok)
+
+    def _csrf(self, path):
+        status, content = self.client.request('GET', path)
+        m = _CSRF_RE.search(content.decode('utf-8', 'replace'))
+        return m.group(1) if m else ''
+
+    def _remember_plans(self, content):
+        ids = _PLAN_RE.findall(content.decode('utf-8', 'replace'))
+        if ids:
+            self.plan_ids = sorted({int(i) for i in ids})[-20:]
+
+    def login(self):
+        token = self._csrf('/login/')
+        status, content = self.client.request('POST', '/login/', {
+            'csrfmiddlewaretoken': token,
+            'username': self.username,
+            'password': self.password,
+        })
+        # a failed login re-renders the form with 200; only the redirect home means success
+        self.logged_in = 300 <= status < 400 and urllib.parse.urlsplit(self.client.location).path == '/home/'
+        return status, content
+
+    def generate(self):
+        token = self._csrf('/home/')
+        subject, grade, topic = self.rng.choice(SAMPLE_TOPICS)
+        status, content = self.client.request('POST', '/home/', {
+            'csrfmiddlewaretoken': token,
+            'subject': subject,
+            'grade': grade,
+            # unique per request, or identical inputs would just reuse an existing plan
+            'topic': f'{topic} ({uuid.uuid4().hex[:8]})',
+            'duration': str(self.rng.choice([30, 40, 45, 60, 80])),
+            'generate': '1',
+        })
+        self._remember_plans(content)
+        return status, content
+
+    def dashboard(self):
+        status, content = self.client.request('GET', '/home/')
+        self._remember_plans(content)
+        return status, content
+
+    def download(self):
+        if not self.plan_ids:
+            self.dashboard()
+        if not self.plan_ids:
+            return self.generate()
+        pk = self.rng.choice(self.plan_ids)
+        fmt = self.rng.choice(['pdf', 'docx'])
+        return self.client.request('GET', f'/lesson/{pk}/{fmt}/')
+
+    def timed(self, action):
+        start = time.perf_counter()
+        try:
+            status, _ = getattr(self, action)()
+        except Exception:
+            status = 0
+        ok = 0 < status < 400 and (action != 'login' or self.logged_in)
+        self.samples.append((action, time.perf_counter() - start, status, ok))
+
+    def run(self, requests, deadline):
+        self.timed('login')
+        if not self.logged_in:
+            # everything after would just be redirected to the login page
+            return self.samples
+        done = 1
+        while True:
+            if deadline is not None:
+                if time.monotonic() >= deadline:
+                    break
+            elif done >= requests:
+                break
+            self.timed(self.rng.choices(self.actions, self.weights)[0])
+            done += 1
+        return self.samples
+
+
+def _run_threads(opts, process_index):
+    """Run ``opts['threads']`` workers in this process; return samples and lock stats."""
+    monitor = LockMonitor(opts['lock_threshold'] / 1000.0)
+    if opts['url']:
+        make_client = lambda: HTTPClient(opts['url'])
+    else:
+        from lesson_planner.wsgi import application
+        make_client = lambda: WSGIClient(application)
+
+    deadline = time.monotonic() + opts['duration'] if opts['duration'] else None
+
+    def thread_main(thread_index):
+        seed = (opts['seed'], process_index, thread_index)
+        worker = Worker(make_client(), opts['username'], opts['password'], opts['mix'], hash(seed))
+        # connections are per thread, so the wrapper is installed per thread too
+        with connection.execute_wrapper(monitor):
+            try:
+                return worker.run(opts['requests'], deadline)
+            finally:
+                connection.close()
+
+    with ThreadPoolExecutor(max_workers=opts['threads']) as pool:
+        results = list(pool.map(thread_main, range(opts['threads'])))
+
+    samples = [s for thread_samples in results for s in thread_samples]
+    return samples, (monitor.waits, monitor.wait_time, monitor.errors)
+
+
+def _process_main(args):
+    opts, process_index = args
+    import django
+    django.setup()
+    return _run_threads(opts, process_index)
+
+
+class Command(BaseCommand):
+    help = 'Generate concurrent load against the lesson planner and report latency percentiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='', help='Base URL of a running server. Defaults to calling the WSGI application in-process.')
+        parser.add_argument('--threads', type=int, default=4, help='Worker threads per process (default: 4).')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes (default: 1).')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per worker thread, including the initial login (default: 100).')
+        parser.add_argument('--duration', type=float, default=0, help='Run for this many seconds instead of a fixed request count.')
+        parser.add_argument('--mix', default=DEFAULT_MIX, help=f'Weighted request mix (default: {DEFAULT_MIX}).')
+        parser.add_argument('--username', default='loadtest', help='Account used by every worker (created if missing in in-process mode).')
+        parser.add_argument('--password', default='loadtest-password')
+        parser.add_argument('--lock-threshold', type=float, default=5.0, help='Write statements slower than this many ms count as lock waits (default: 5).')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--cleanup', action='store_true', help="Delete the load-test user's lesson plans afterwards (in-process mode only).")
+
+    def handle(self, *args, **options):
+        if options['threads'] < 1 or options['processes'] < 1:
+            raise CommandError('--threads and --processes must be at least 1.')
+
+        opts = {
+            'url': options['url'],
+            'threads': options['threads'],
+            'requests': max(1, options['requests']),
+            'duration': options['duration'],
+            'mix': parse_mix(options['mix']),
+            'username': options['username'],
+            'password': options['password'],
+            'lock_threshold': options['lock_threshold'],
+            'seed': options['seed'],
+        }
+
+        if not opts['url']:
+            self._ensure_user(opts['username'], opts['password'])
+
+        connections.close_all()  # never share an open SQLite handle with child processes
+
+        started = time.perf_counter()
+        if options['processes'] == 1:
+            outputs = [_run_threads(opts, 0)]
+        else:
+            with multiprocessing.Pool(options['processes']) as pool:
+                outputs = pool.map(_process_main, [(opts, i) for i in range(options['processes'])])
+        elapsed = time.perf_counter() - started
+
+        samples = [s for out, _ in outputs for s in out]
+        waits = sum(lock[0] for _, lock in outputs)
+        wait_time = sum(lock[1] for _, lock in outputs)
+        lock_errors = sum(lock[2] for _, lock in outputs)
+
+        self._report(samples, elapsed, options, waits, wait_time, lock_errors)
+
+        if options['cleanup'] and not opts['url']:
+            deleted, _ = LessonPlan.objects.filter(user__username=opts['username']).delete()
+            self.stdout.write(f'Cleanup: deleted {deleted} lesson plans.')
+
+        failed_logins = sum(1 for action, _, _, ok in samples if action == 'login' and not ok)
+        if failed_logins:
+            raise CommandError(
+                f"{failed_logins} worker(s) could not log in as '{opts['username']}'; "
+                'check --username/--password. Those workers sent no further requests.'
+            )
+
+    def _ensure_user(self, username, password):
+        user, created = User.objects.get_or_create(username=username)
+        if created or not user.check_password(password):
+            user.set_password(password)
+            user.save()
+
+    def _report(self, samples, elapsed, options, waits, wait_time, lock_errors):
+        by_action = defaultdict(list)
+        for action, seconds, _, ok in samples:
+            by_action[action].append((seconds, ok))
+
+        target = options['url'] or 'lesson_planner.wsgi.application (in-process)'
+        self.stdout.write(f"Target: {target}")
+        self.stdout.write(f"Workers: {options['processes']} process(es) x {options['threads']} thread(s)")
+        self.stdout.write(f'Elapsed: {elapsed:.2f}s  Requests: {len(samples)}  Throughput: {len(samples) / elapsed if elapsed else 0:.1f} req/s')
+        self.stdout.write('')
+        header = f"{'action':<10} {'count':>7} {'errors':>7} {'err%':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for action in ACTIONS + ('total',):
+            rows = [r for rs in by_action.values() for r in rs] if action == 'total' else by_action.get(action)
+            if not rows:
+                continue
+            latencies = sorted(seconds * 1000 for seconds, _ in rows)
+            errors = sum(1 for _, ok in rows if not ok)
+            self.stdout.write(
+                f'{action:<10} {len(rows):>7} {errors:>7} {100.0 * errors / len(rows):>5.1f}% '
+                f'{percentile(latencies, 50):>9.1f} {percentile(latencies, 95):>9.1f} '
+                f'{percentile(latencies, 99):>9.1f} {latencies[-1]:>9.1f}'
+            )
+        self.stdout.write('')
+        if options['url']:
+            self.stdout.write('DB lock waits: not measured against a remote server.')
+        else:
+            self.stdout.write(
+                f"DB lock waits: {waits} writes over {options['lock_threshold']:g} ms "
+                f'({wait_time * 1000:.1f} ms total), {lock_errors} "database is locked" errors'
+            )
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from lesson_generator import similarity
+from lesson_generator.models import LessonPlan
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the similar-plan suggestion index from the LessonPlan table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        if not similarity.available():
+            raise CommandError('numpy and scipy are required for similar-plan suggestions (pip install numpy scipy).')
+        total = similarity.rebuild(LessonPlan.objects.all(), batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {total} lesson plans in {similarity.index_dir()}.'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from lesson_generator import stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute the PlanUsageStat summary table from all lesson plans, including archived ones.'
+
+    def handle(self, *args, **options):
+        buckets = stats.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt usage statistics: {buckets} subject/grade/month buckets.'))
@@ -0,0 +1,49 @@
+"""Copy the primary SQLite database onto its replica files with the backup API.
+
+Lets the primary/replica router be exercised locally::
+
+    set LESSON_PLANNER_SQLITE_REPLICA=1
+    python manage.py sync_sqlite_replica --interval 5
+"""
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Copy the default SQLite database onto the SQLite replicas listed in REPLICA_DATABASES.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=0, help='Keep syncing every N seconds instead of once.')
+        parser.add_argument('--pages', type=int, default=256, help='Pages copied per backup step (default: 256).')
+
+    def _sqlite_path(self, alias):
+        db = settings.DATABASES[alias]
+        if db['ENGINE'] != 'django.db.backends.sqlite3':
+            raise CommandError(f"Database '{alias}' is not SQLite; use the server's own replication.")
+        return str(db['NAME'])
+
+    def handle(self, *args, **options):
+        replicas = getattr(settings, 'REPLICA_DATABASES', [])
+        if not replicas:
+            raise CommandError('No REPLICA_DATABASES configured (set LESSON_PLANNER_SQLITE_REPLICA=1).')
+        primary = self._sqlite_path('default')
+        targets = [(alias, self._sqlite_path(alias)) for alias in replicas]
+
+        while True:
+            for alias, path in targets:
+                start = time.perf_counter()
+                src = sqlite3.connect(primary)
+                dst = sqlite3.connect(path)
+                try:
+                    # the backup is a consistent snapshot even while the primary is being written
+                    src.backup(dst, pages=options['pages'])
+                finally:
+                    dst.close()
+                    src.close()
+                self.stdout.write(f"Synced '{alias}' in {(time.perf_counter() - start) * 1000:.0f} ms")
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,155 @@
+import cProfile
+import os
+import re
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+
+
+PROFILE_QUERY_PARAM = 'profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_TRUE_VALUES = ('1', 'true')
+
+_NAME_RE = re.compile(r'^[\w.-]+\.prof$')
+_write_lock = threading.Lock()
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def profile_max_files():
+    return int(getattr(settings, 'PROFILE_MAX_FILES', 50))
+
+
+def profile_path(name):
+    """Return the absolute path of a stored profile, or None if the name is invalid/missing."""
+    if not _NAME_RE.match(name):
+        return None
+    path = os.path.join(profile_dir(), name)
+    return path if os.path.isfile(path) else None
+
+
+def _by_age(directory):
+    """Return the stored profile names, oldest first.
+
+    Sorted by modification time: the filename's timestamp only has one-second
+    resolution and the elapsed field that follows it does not sort as a number.
+    """
+    stamped = []
+    for name in os.listdir(directory):
+        if not _NAME_RE.match(name):
+            continue
+        try:
+            stamped.append((os.stat(os.path.join(directory, name)).st_mtime_ns, name))
+        except FileNotFoundError:
+            pass  # evicted by another request meanwhile
+    return [name for _, name in sorted(stamped)]
+
+
+def list_profiles():
+    """Return stored profiles, newest first, as dicts parsed from their filenames."""
+    directory = profile_dir()
+    try:
+        names = _by_age(directory)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in reversed(names):
+        # <timestamp>_<ms>ms_<method>_<path-slug>_<id>.prof
+        head = name[:-len('.prof')].rsplit('_', 1)[0]
+        parts = head.split('_', 3)
+        if len(parts) != 4:
+            continue
+        stamp, elapsed, method, slug = parts
+        profiles.append({
+            'name': name,
+            'created': stamp,
+            'elapsed_ms': elapsed[:-2],
+            'method': method,
+            'path': '/' + slug.replace('.', '/').strip('/'),
+            'size': os.path.getsize(os.path.join(directory, name)),
+        })
+    return profiles
+
+
+def _store(profiler, request, elapsed):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^\w-]+', '.', request.path).strip('.') or 'root'
+    name = (
+        f"{timezone.now():%Y%m%dT%H%M%S}_{int(elapsed * 1000)}ms_"
+        f"{request.method}_{slug[:80]}_{uuid.uuid4().hex[:8]}.prof"
+    )
+    profiler.dump_stats(os.path.join(directory, name))
+
+    # Ring buffer: drop the oldest files once over the limit
+    with _write_lock:
+        names = _by_age(directory)
+        for old in names[:max(0, len(names) - profile_max_files())]:
+            try:
+                os.remove(os.path.join(directory, old))
+            except FileNotFoundError:
+                pass
+    return name
+
+
+class ProfilingMiddleware:
+    """Profile a single request with cProfile when a staff user asks for it.
+
+    Add ``?profile=1`` to the URL or send an ``X-Profile: 1`` header. The profile
+    covers everything below this middleware (view, ORM queries, PDF/DOCX
+    rendering) and is written to PROFILE_DIR, keeping at most PROFILE_MAX_FILES.
+    For streaming responses (e.g. the history export) the profiler is also
+    switched on while each chunk of the body is produced, and the profile is
+    stored once the body has been sent, so those responses carry no
+    X-Profile-Id header. Untriggered requests only pay for a dict lookup.
+    Must be placed after AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        flag = request.GET.get(PROFILE_QUERY_PARAM) or request.META.get(PROFILE_HEADER) or ''
+        if flag.lower() not in PROFILE_TRUE_VALUES:
+            return self.get_response(request)
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_staff:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # another profiler is already active on this thread
+            return self.get_response(request)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            profiler.disable()
+        if response.streaming:
+            response.streaming_content = self._profile_stream(profiler, request, start, response.streaming_content)
+            return response
+        name = _store(profiler, request, time.perf_counter() - start)
+        response['X-Profile-Id'] = name
+        return response
+
+    def _profile_stream(self, profiler, request, start, content):
+        chunks = iter(content)
+        try:
+            while True:
+                profiler.enable()
+                try:
+                    chunk = next(chunks)
+                except StopIteration:
+                    return
+                finally:
+                    profiler.disable()
+                yield chunk
+        finally:
+            _store(profiler, request, time.perf_counter() - start)
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:43
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def fill_usage_stats(apps, schema_editor):
+    """Count the plans saved before the summary table existed.
+
+    Archived plans are not counted here; run ``manage.py rebuild_usage_stats``
+    once if plans were archived before this migration.
+    """
+    LessonPlan = apps.get_model("lesson_generator", "LessonPlan")
+    PlanUsageStat = apps.get_model("lesson_generator", "PlanUsageStat")
+    rows = (
+        LessonPlan.objects.annotate(
+            month=TruncMonth("created", output_field=models.DateField())
+        )
+        .values("subject", "grade", "month")
+        .annotate(plan_count=Count("id"), total_duration=Sum("duration"))
+        .order_by()
+    )
+    PlanUsageStat.objects.bulk_create(
+        [
+            PlanUsageStat(
+                subject=row["subject"],
+                grade=row["grade"],
+                month=row["month"],
+                plan_count=row["plan_count"],
+                total_duration=row["total_duration"] or 0,
+            )
+            for row in rows
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lesson_generator", "0005_passwordresetcode"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PlanUsageStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("subject", models.CharField(max_length=200)),
+                ("grade", models.CharField(max_length=100)),
+                ("month", models.DateField()),
+                ("plan_count", models.PositiveIntegerField(default=0)),
+                ("total_duration", models.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("subject", "grade", "month"),
+                        name="unique_usage_stat_bucket",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(fill_usage_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:44
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("lesson_generator", "0006_planusagestat"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="lessonplan",
+            name="input_hash",
+            field=models.CharField(
+                blank=True, db_index=True, editable=False, max_length=64
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="lessonplan",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("input_hash", ""), _negated=True),
+                fields=("user", "input_hash"),
+                name="unique_lessonplan_per_user_input",
+            ),
+        ),
+    ]
@@ -1,3 +1,5 @@
+import hashlib
+
 from django.db import models
 from django.conf import settings
 
@@ -11,6 +13,33 @@ class LessonPlan(models.Model):
     teacher_actions = models.TextField(blank=True)  # new optional field
     student_requirements = models.TextField(blank=True)
     created = models.DateTimeField(auto_now_add=True)
+    # sha256 of the inputs and generated content, used to reuse identical plans
+    input_hash = models.CharField(max_length=64, blank=True, db_index=True, editable=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "input_hash"],
+                condition=~models.Q(input_hash=""),
+                name="unique_lessonplan_per_user_input",
+            ),
+        ]
+
+    @staticmethod
+    def compute_input_hash(subject, grade, topic, duration, content, teacher_actions="", student_requirements=""):
+        """Return the hex digest identifying a plan by what it contains (not who owns it)."""
+        parts = [subject, grade, topic, str(duration), teacher_actions, student_requirements, content]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def save(self, *args, **kwargs):
+        # Only new plans get a hash: re-hashing edits (e.g. in the admin) could
+        # collide with an older duplicate and fail the unique constraint.
+        if self._state.adding and not self.input_hash:
+            self.input_hash = self.compute_input_hash(
+                self.subject, self.grade, self.topic, self.duration, self.content,
+                self.teacher_actions, self.student_requirements,
+            )
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.subject} — {self.topic} ({self.created:%Y-%m-%d %H:%M})"
@@ -23,3 +52,28 @@ class PasswordResetCode(models.Model):
 
     def __str__(self):
         return f"Reset code for {self.user} at {self.created}"
+
+
+class PlanUsageStat(models.Model):
+    """Running plan counts per subject, grade and month.
+
+    Kept up to date by the signal handlers in signals.py so reports never have
+    to aggregate the LessonPlan table. Rebuild with ``manage.py rebuild_usage_stats``.
+    """
+    subject = models.CharField(max_length=200)
+    grade = models.CharField(max_length=100)
+    month = models.DateField()  # first day of the month the plans were created in
+    plan_count = models.PositiveIntegerField(default=0)
+    total_duration = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["subject", "grade", "month"], name="unique_usage_stat_bucket"),
+        ]
+
+    @property
+    def average_duration(self):
+        return self.total_duration / self.plan_count if self.plan_count else 0
+
+    def __str__(self):
+        return f"{self.subject} / {self.grade} ({self.month:%Y-%m}): {self.plan_count} plans"
@@ -0,0 +1,68 @@
+import logging
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import similarity, stats
+from .models import LessonPlan
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(pre_save, sender=LessonPlan)
+def remember_stat_bucket(sender, instance, raw=False, **kwargs):
+    # Edits (e.g. through the admin) can move a plan to another bucket
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    old = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('subject', 'grade', 'created', 'duration', 'topic', 'content')
+        .first()
+    )
+    if old is not None:
+        instance._stat_bucket = (old[0], old[1], stats.month_of(old[2]), old[3] or 0)
+        instance._indexed_text = (old[4], old[5])
+
+
+@receiver(post_save, sender=LessonPlan)
+def update_stats_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = stats.bucket_of(instance)
+    if created:
+        stats.apply(*new, 1)
+        return
+    old = getattr(instance, '_stat_bucket', None)
+    if old is not None and old != new:
+        stats.apply(*old, -1)
+        stats.apply(*new, 1)
+    instance._stat_bucket = new
+
+
+@receiver(post_delete, sender=LessonPlan)
+def update_stats_on_delete(sender, instance, **kwargs):
+    if stats.is_suspended():
+        return
+    stats.apply(*stats.bucket_of(instance), -1)
+
+
+@receiver(post_save, sender=LessonPlan)
+def index_for_similarity(sender, instance, created, raw=False, **kwargs):
+    if raw or not similarity.available():
+        return
+    text = (instance.topic, instance.content)
+    if not created and getattr(instance, '_indexed_text', None) == text:
+        # appending again would only inflate the document frequencies
+        return
+    instance._indexed_text = text
+
+    def add():
+        try:
+            similarity.add_plans([instance])
+        except Exception:
+            # the save is already committed: never turn it into an error over the
+            # suggestion index; rebuild_similarity_index restores it
+            logger.exception('Could not add lesson plan %s to the similarity index', instance.pk)
+
+    transaction.on_commit(add)
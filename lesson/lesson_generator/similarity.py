@@ -0,0 +1,306 @@
+"""Similar-plan suggestions over the saved lesson plans.
+
+Each plan (topic weighted over content) becomes a row of a sparse CSR matrix
+of hashed terms, weighted SMART "lnc.ltc" style: documents store
+``1 + log(tf)`` normalised to unit length, and inverse document frequency is
+applied to the query only. Because document rows never depend on the rest of
+the corpus, new plans are simply appended; the document-frequency vector is
+updated in place. A plan whose topic or content is edited is appended again
+and only its last row is scored.
+
+The matrix lives in SIMILARITY_DIR as raw arrays that are appended to on
+save and memory mapped on read, so a query is one sparse matrix product over
+the mapped pages. Superseded rows and rows of deleted plans are dropped at
+query time; ``manage.py rebuild_similarity_index`` compacts the files and
+recounts document frequencies.
+
+numpy and scipy are optional: without them ``available()`` is False and no
+suggestions are made.
+"""
+import os
+import re
+import shutil
+import threading
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:
+    np = sparse = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: only in-process locking
+    fcntl = None
+
+N_FEATURES = 1 << 18
+TOPIC_WEIGHT = 3
+
+# name -> dtype of each append-only array; ids is written last and defines the row count
+ARRAYS = {
+    'indptr': 'int32',
+    'indices': 'int32',
+    'data': 'float32',
+    'users': 'int64',
+    'ids': 'int64',
+}
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from in into is it of on or the to with will students student teacher actions'.split()
+)
+
+_thread_lock = threading.Lock()
+_cache = {}
+
+
+def available():
+    return np is not None
+
+
+def index_dir():
+    return str(getattr(settings, 'SIMILARITY_DIR', os.path.join(settings.BASE_DIR, 'similarity')))
+
+
+def _path(name, directory=None):
+    return os.path.join(directory or index_dir(), name + '.bin')
+
+
+@contextmanager
+def _locked():
+    directory = index_dir()
+    os.makedirs(os.path.dirname(directory) or '.', exist_ok=True)
+    with _thread_lock, open(directory + '.lock', 'a+b') as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall((text or '').lower()) if t not in STOP_WORDS and len(t) > 1]
+
+
+def _feature(token):
+    return zlib.crc32(token.encode('utf-8')) % N_FEATURES
+
+
+def term_counts(topic, content=''):
+    counts = Counter()
+    for token in tokenize(topic):
+        counts[_feature(token)] += TOPIC_WEIGHT
+    for token in tokenize(content):
+        counts[_feature(token)] += 1
+    return counts
+
+
+def _document_row(counts):
+    """Return (sorted feature indices, unit-length log-tf weights)."""
+    indices = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+    weights = 1.0 + np.log(np.array([counts[i] for i in indices], dtype=np.float32))
+    norm = float(np.linalg.norm(weights))
+    return indices, (weights / norm if norm else weights).astype(np.float32)
+
+
+def _length(name, directory=None):
+    try:
+        return os.path.getsize(_path(name, directory)) // np.dtype(ARRAYS[name]).itemsize
+    except FileNotFoundError:
+        return 0
+
+
+def _ensure(directory):
+    os.makedirs(directory, exist_ok=True)
+    if not os.path.exists(_path('indptr', directory)):
+        np.zeros(1, dtype=np.int32).tofile(_path('indptr', directory))
+    if not os.path.exists(_path('df', directory)):
+        np.zeros(N_FEATURES, dtype=np.float32).tofile(_path('df', directory))
+    # drop anything an interrupted append left beyond the last complete row
+    n = _length('ids', directory)
+    nnz = _last_indptr(directory, n)
+    limits = {'indptr': n + 1, 'users': n, 'indices': nnz, 'data': nnz}
+    for name, count in limits.items():
+        path = _path(name, directory)
+        size = count * np.dtype(ARRAYS[name]).itemsize
+        if (os.path.getsize(path) if os.path.exists(path) else 0) != size:
+            with open(path, 'ab') as f:
+                f.truncate(size)
+    return nnz
+
+
+def _last_indptr(directory, n):
+    """Return indptr[n] without reading the whole array."""
+    itemsize = np.dtype(ARRAYS['indptr']).itemsize
+    return int(np.fromfile(_path('indptr', directory), dtype=ARRAYS['indptr'], count=1, offset=n * itemsize)[0])
+
+
+def _append(plans, directory):
+    """Append one row per plan. Must be called with the index lock held."""
+    end = _ensure(directory)
+    indptr, indices, data, users, ids = [], [], [], [], []
+    touched = Counter()
+    for plan in plans:
+        counts = term_counts(plan.topic, plan.content)
+        if not counts:
+            continue
+        row_indices, row_data = _document_row(counts)
+        end += len(row_indices)
+        indptr.append(end)
+        indices.append(row_indices)
+        data.append(row_data)
+        users.append(plan.user_id or 0)
+        ids.append(plan.pk)
+        touched.update(counts.keys())
+    if not ids:
+        return 0
+
+    for name, values in (
+        ('data', np.concatenate(data)),
+        ('indices', np.concatenate(indices)),
+        ('indptr', np.array(indptr, dtype=np.int32)),
+        ('users', np.array(users, dtype=np.int64)),
+        ('ids', np.array(ids, dtype=np.int64)),
+    ):
+        with open(_path(name, directory), 'ab') as f:
+            values.astype(ARRAYS[name], copy=False).tofile(f)
+
+    df = np.memmap(_path('df', directory), dtype=np.float32, mode='r+', shape=(N_FEATURES,))
+    keys = np.fromiter(touched.keys(), dtype=np.int64, count=len(touched))
+    df[keys] += np.fromiter(touched.values(), dtype=np.float32, count=len(touched))
+    df.flush()
+    del df
+    return len(ids)
+
+
+def add_plans(plans):
+    """Append plans to the on-disk index; a plan added again supersedes its earlier rows."""
+    if not available():
+        return 0
+    with _locked():
+        return _append(plans, index_dir())
+
+
+def rebuild(queryset, batch_size=2000):
+    """Rewrite the index from ``queryset`` and atomically swap it into place.
+
+    Saves are not blocked while the new index is built: plans appended to the
+    live index meanwhile are re-added to the new one just before the swap.
+    """
+    directory = index_dir()
+    staging = directory + '.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    with _locked():
+        start = _length('ids', directory)
+    total = 0
+    batch = []
+    for plan in queryset.order_by('pk').iterator(chunk_size=batch_size):
+        batch.append(plan)
+        if len(batch) >= batch_size:
+            total += _append(batch, staging)
+            batch = []
+    total += _append(batch, staging)
+    with _locked():
+        if _length('ids', directory) > start:
+            itemsize = np.dtype(ARRAYS['ids']).itemsize
+            appended = np.fromfile(_path('ids', directory), dtype=ARRAYS['ids'], offset=start * itemsize)
+            # a plan read above and appended again is harmless: its last row wins
+            pks = sorted(set(appended.tolist()))
+            for i in range(0, len(pks), 500):
+                total += _append(queryset.filter(pk__in=pks[i:i + 500]).order_by('pk'), staging)
+        _ensure(staging)
+        old = directory + '.old'
+        shutil.rmtree(old, ignore_errors=True)  # left over from an interrupted swap
+        if os.path.exists(directory):
+            os.replace(directory, old)
+        os.replace(staging, directory)
+        shutil.rmtree(old, ignore_errors=True)
+    return total
+
+
+def _load():
+    """Return the memory-mapped index (cached until the files change), or None if empty."""
+    directory = index_dir()
+    try:
+        st = os.stat(_path('ids', directory))
+    except FileNotFoundError:
+        return None
+    key = (directory, st.st_ino, st.st_size, st.st_mtime_ns)
+    cached = _cache.get('index')
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    n = st.st_size // np.dtype(ARRAYS['ids']).itemsize
+    if n == 0:
+        return None
+
+    def mapped(name, count):
+        return np.memmap(_path(name, directory), dtype=ARRAYS[name], mode='r', shape=(count,))
+
+    indptr = mapped('indptr', n + 1)
+    nnz = int(indptr[n])
+    ids = mapped('ids', n)
+    # only the last row of each plan is current
+    _, first_from_end = np.unique(ids[::-1], return_index=True)
+    latest = np.zeros(n, dtype=bool)
+    latest[n - 1 - first_from_end] = True
+    index = {
+        'matrix': sparse.csr_matrix(
+            (mapped('data', nnz), mapped('indices', nnz), indptr), shape=(n, N_FEATURES), copy=False
+        ),
+        'ids': ids,
+        'users': mapped('users', n),
+        'latest': latest,
+        'df': np.memmap(_path('df', directory), dtype=np.float32, mode='r', shape=(N_FEATURES,)),
+    }
+    _cache['index'] = (key, index)
+    return index
+
+
+def query(texts, user_id=None, limit=5, min_score=0.05):
+    """Return, for each ``(topic, extra_text)`` query, a list of ``(plan_id, score)``.
+
+    All queries are scored in one sparse-by-dense product. With ``user_id``
+    only that user's plans are considered. Scores are cosine similarities.
+    Up to ``limit * 3`` candidates are returned, best first, so that callers
+    can drop deleted plans and still cut the list down to ``limit``.
+    """
+    if not available():
+        return [[] for _ in texts]
+    index = _load()
+    if index is None:
+        return [[] for _ in texts]
+
+    n_docs = len(index['ids'])
+    queries = np.zeros((N_FEATURES, len(texts)), dtype=np.float32)
+    for col, (topic, extra) in enumerate(texts):
+        counts = term_counts(topic, extra)
+        if not counts:
+            continue
+        features, weights = _document_row(counts)
+        idf = np.log((n_docs + 1) / (index['df'][features] + 1)) + 1
+        weights = weights * idf
+        queries[features, col] = weights / np.linalg.norm(weights)
+
+    scores = index['matrix'] @ queries  # (n_docs, n_queries)
+    scores[~index['latest']] = 0
+    if user_id is not None:
+        scores[index['users'] != user_id] = 0
+
+    results = []
+    for col in range(len(texts)):
+        column = scores[:, col]
+        # over-fetch: some rows may belong to deleted or archived plans
+        k = min(len(column), limit * 3)
+        top = np.argpartition(-column, k - 1)[:k]
+        matches = []
+        for row in top[np.argsort(-column[top])]:
+            score = float(column[row])
+            if score < min_score:
+                break
+            matches.append((int(index['ids'][row]), score))
+        results.append(matches)
+    return results
@@ -26,34 +26,127 @@ document.addEventListener('DOMContentLoaded', () => {
     themeToggle.addEventListener('click', () => applyTheme(!(localStorage.getItem('lp-dark') === '1')));
   }
 
-  // Prevent double submit + show spinner
+  // Prevent double submit + show spinner; "Generate" goes through fetch and
+  // only swaps in the new plan, the download buttons still post the form
   const genForm = document.getElementById('generate-form');
   if (genForm) {
     const submitBtn = genForm.querySelector('button[type="submit"]');
-    genForm.addEventListener('submit', () => {
-      if (submitBtn) {
-        submitBtn.disabled = true;
+
+    const setBusy = (busy) => {
+      if (!submitBtn) return;
+      submitBtn.disabled = busy;
+      if (busy) {
         submitBtn.dataset.orig = submitBtn.innerHTML;
         submitBtn.innerHTML = '<span class="spinner" aria-hidden="true"></span> Generating...';
+      } else if (submitBtn.dataset.orig) {
+        submitBtn.innerHTML = submitBtn.dataset.orig;
+      }
+    };
+
+    const showPlan = (data) => {
+      const target = document.getElementById('generated-plan');
+      if (target) target.innerHTML = data.plan_html;
+
+      const list = document.getElementById('recent-list');
+      if (!list) return;
+      const empty = list.querySelector('.no-plans');
+      if (empty) empty.remove();
+      const existing = list.querySelector(`[data-plan-id="${data.id}"]`);
+      if (existing) existing.remove();
+      list.insertAdjacentHTML('afterbegin', data.card_html);
+      const cards = list.querySelectorAll('[data-plan-id]');
+      for (let i = 10; i < cards.length; i++) cards[i].remove();
+    };
+
+    genForm.addEventListener('submit', async (e) => {
+      const url = genForm.dataset.generateUrl;
+      const isGenerate = !e.submitter || e.submitter.name === 'generate';
+      if (!url || !isGenerate || !window.fetch) {
+        setBusy(true);
+        return;
+      }
+      e.preventDefault();
+      setBusy(true);
+      try {
+        const res = await fetch(url, {
+          method: 'POST',
+          body: new FormData(genForm),
+          headers: { 'X-Requested-With': 'XMLHttpRequest' },
+          credentials: 'same-origin',
+        });
+        const data = await res.json();
+        if (!res.ok) {
+          showToast(data.error || 'Could not generate the lesson plan');
+          return;
+        }
+        showPlan(data);
+        showToast(data.message);
+      } catch {
+        // Fall back to a normal full-page submit
+        genForm.submit();
+        return;
+      } finally {
+        setBusy(false);
       }
     });
   }
 
-  // Copy generated plan to clipboard
-  const copyBtn = document.getElementById('copy-plan');
-  if (copyBtn) {
-    copyBtn.addEventListener('click', async () => {
-      const pre = document.querySelector('.lesson-plan pre');
-      if (!pre) { showToast('Nothing to copy'); return; }
+  // Suggest saved plans similar to the subject/topic being typed
+  const similarBox = document.getElementById('similar-plans');
+  if (genForm && similarBox) {
+    const subjectInput = genForm.querySelector('#subject');
+    const topicInput = genForm.querySelector('#topic');
+    let timer = null;
+    let controller = null;
+
+    const escapeHtml = (text) => {
+      const div = document.createElement('div');
+      div.textContent = text;
+      return div.innerHTML;
+    };
+
+    const lookup = async () => {
+      const topic = topicInput.value.trim();
+      if (topic.length < 3) { similarBox.hidden = true; return; }
+      if (controller) controller.abort();
+      controller = new AbortController();
+      const params = new URLSearchParams({ subject: subjectInput ? subjectInput.value.trim() : '', topic });
       try {
-        await navigator.clipboard.writeText(pre.innerText);
-        showToast('Copied to clipboard');
-      } catch {
-        showToast('Copy failed');
+        const res = await fetch(`${similarBox.dataset.url}?${params}`, { signal: controller.signal, credentials: 'same-origin' });
+        const data = await res.json();
+        if (!data.results || !data.results.length) { similarBox.hidden = true; return; }
+        similarBox.innerHTML = '<strong>You already have similar plans:</strong><ul>' + data.results.map(p =>
+          `<li>${escapeHtml(p.subject)} — ${escapeHtml(p.topic)} (${escapeHtml(p.grade)}) ` +
+          `<a href="${p.pdf_url}" download>PDF</a> · <a href="${p.docx_url}" download>DOCX</a></li>`
+        ).join('') + '</ul>';
+        similarBox.hidden = false;
+      } catch (err) {
+        if (err.name !== 'AbortError') similarBox.hidden = true;
       }
+    };
+
+    [subjectInput, topicInput].forEach(input => {
+      if (!input) return;
+      input.addEventListener('input', () => {
+        clearTimeout(timer);
+        timer = setTimeout(lookup, 300);
+      });
     });
   }
 
+  // Copy generated plan to clipboard (delegated: the plan block is replaced after each generate)
+  document.addEventListener('click', async (e) => {
+    if (!e.target.closest('#copy-plan')) return;
+    const pre = document.querySelector('.lesson-plan pre');
+    if (!pre) { showToast('Nothing to copy'); return; }
+    try {
+      await navigator.clipboard.writeText(pre.innerText);
+      showToast('Copied to clipboard');
+    } catch {
+      showToast('Copy failed');
+    }
+  });
+
   // Toggle recent plans collapse
   document.querySelectorAll('.toggle-recent').forEach(btn => {
     btn.addEventListener('click', () => {
@@ -0,0 +1,98 @@
+"""Incrementally maintained plan usage statistics (see PlanUsageStat)."""
+import threading
+from contextlib import contextmanager
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DateField, F, Sum, Value
+from django.db.models.functions import Greatest, TruncMonth
+from django.utils import timezone
+
+from .models import LessonPlan, PlanUsageStat
+
+_local = threading.local()
+
+
+def month_of(dt):
+    """Return the first day of the (local-time) month ``dt`` falls in."""
+    if timezone.is_aware(dt):
+        dt = timezone.localtime(dt)
+    return dt.date().replace(day=1)
+
+
+def bucket_of(plan):
+    return (plan.subject, plan.grade, month_of(plan.created), plan.duration or 0)
+
+
+def is_suspended():
+    return getattr(_local, 'suspended', False)
+
+
+@contextmanager
+def suspended():
+    """Skip stat updates for deletes that do not remove plans, e.g. archiving."""
+    previous = is_suspended()
+    _local.suspended = True
+    try:
+        yield
+    finally:
+        _local.suspended = previous
+
+
+def apply(subject, grade, month, duration, sign):
+    """Add (sign=1) or remove (sign=-1) one plan from its bucket."""
+    bucket = PlanUsageStat.objects.filter(subject=subject, grade=grade, month=month)
+    if sign < 0:
+        # clamp at zero so a miscounted bucket can never make a delete fail
+        bucket.update(
+            plan_count=Greatest(F('plan_count') - 1, Value(0)),
+            total_duration=Greatest(F('total_duration') - duration, Value(0)),
+        )
+        return
+    changes = {'plan_count': F('plan_count') + 1, 'total_duration': F('total_duration') + duration}
+    if bucket.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            PlanUsageStat.objects.create(
+                subject=subject, grade=grade, month=month, plan_count=1, total_duration=duration
+            )
+    except IntegrityError:
+        # another request created the bucket between our update and insert
+        bucket.update(**changes)
+
+
+def collect_totals():
+    """Return ``{(subject, grade, month): [plan_count, total_duration]}`` over the table and the archive."""
+    from . import archive
+
+    totals = {}
+    rows = (
+        LessonPlan.objects
+        .annotate(month=TruncMonth('created', output_field=DateField()))
+        .values('subject', 'grade', 'month')
+        .annotate(plan_count=Count('id'), total_duration=Sum('duration'))
+        .order_by()
+    )
+    for row in rows:
+        totals[(row['subject'], row['grade'], row['month'])] = [row['plan_count'], row['total_duration'] or 0]
+    for plan in archive.iter_plans():
+        subject, grade, month, duration = bucket_of(plan)
+        entry = totals.setdefault((subject, grade, month), [0, 0])
+        entry[0] += 1
+        entry[1] += duration
+    return totals
+
+
+def rebuild():
+    """Recompute every bucket from the LessonPlan table and the archive."""
+    totals = collect_totals()
+    with transaction.atomic():
+        PlanUsageStat.objects.all().delete()
+        PlanUsageStat.objects.bulk_create(
+            [
+                PlanUsageStat(subject=s, grade=g, month=m, plan_count=c, total_duration=d)
+                for (s, g, m), (c, d) in totals.items()
+            ],
+            batch_size=500,
+        )
+    return len(totals)
@@ -1,3 +1,307 @@
-from django.test import TestCase
+import gzip
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.db import router
+from django.http import HttpResponse, StreamingHttpResponse
+from django.core.management import call_command
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from lesson_planner.db_routers import PIN_COOKIE, ReplicaPinningMiddleware
+
+from . import archive, similarity, stats
+from .models import LessonPlan, PlanUsageStat
+
+
+class TempDirsMixin:
+    """Point the archive and similarity index at a throwaway directory."""
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+        overrides = override_settings(
+            ARCHIVE_DIR=os.path.join(self.tmp, 'archive'),
+            SIMILARITY_DIR=os.path.join(self.tmp, 'similarity'),
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+
+    def make_plan(self, user, topic='Fractions', **fields):
+        values = dict(subject='Mathematics', grade='Grade 7', duration=45, content=f'Plan about {topic}.')
+        values.update(fields)
+        return LessonPlan.objects.create(user=user, topic=topic, **values)
+
+
+class ArchiveTests(TempDirsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.alice = User.objects.create_user('alice', password='pw-alice-1')
+        self.bob = User.objects.create_user('bob', password='pw-bob-1')
+        # more than one block, with the users interleaved
+        self.plans = [
+            self.make_plan(self.alice if i % 3 else self.bob, topic=f'Topic {i}')
+            for i in range(archive.BLOCK_RECORDS + 10)
+        ]
+
+    def test_write_segment_round_trip(self):
+        base = archive.write_segment(self.plans)
+        for plan in (self.plans[0], self.plans[archive.BLOCK_RECORDS], self.plans[-1]):
+            loaded = archive.load_plan(plan.pk)
+            self.assertEqual(loaded.pk, plan.pk)
+            self.assertEqual(loaded.topic, plan.topic)
+            self.assertEqual(loaded.user_id, plan.user_id)
+            self.assertEqual(loaded.created, plan.created)
+        self.assertIsNone(archive.load_plan(self.plans[-1].pk + 1000))
+        self.assertEqual([p.pk for p in archive.iter_plans()], [p.pk for p in self.plans])
+        for suffix in (archive.SEGMENT_SUFFIX, archive.INDEX_SUFFIX, archive.USER_INDEX_SUFFIX):
+            self.assertEqual(stat.S_IMODE(os.stat(base + suffix).st_mode), archive.FILE_MODE)
+
+    def test_iter_user_plans(self):
+        archive.write_segment(self.plans[:archive.BLOCK_RECORDS])
+        archive.write_segment(self.plans[archive.BLOCK_RECORDS:])
+        for user in (self.alice, self.bob):
+            self.assertEqual(
+                [p.pk for p in archive.iter_user_plans(user.id)],
+                [p.pk for p in self.plans if p.user_id == user.id],
+            )
+        self.assertEqual(list(archive.iter_user_plans(self.bob.id + 1000)), [])
+
+    def test_archived_ids(self):
+        archive.write_segment(self.plans[:5])
+        ids = [p.pk for p in self.plans[3:8]]
+        self.assertEqual(archive.archived_ids(ids), set(ids[:2]))
+
+    def test_rerun_after_interrupted_archive_does_not_duplicate(self):
+        # a run that wrote its segment but died before deleting the rows
+        archive.write_segment(self.plans)
+        call_command('archive_plans', '--older-than-days', '-1', stdout=io.StringIO())
+        self.assertFalse(LessonPlan.objects.exists())
+        self.assertEqual(len(os.listdir(archive.archive_dir())), 3)
+        self.assertEqual(sorted(p.pk for p in archive.iter_plans()), [p.pk for p in self.plans])
+
+    def test_lesson_pdf_falls_back_to_archive(self):
+        plan = self.plans[1]
+        call_command('archive_plans', '--older-than-days', '-1', stdout=io.StringIO())
+        self.assertFalse(LessonPlan.objects.filter(pk=plan.pk).exists())
+
+        self.client.login(username='alice', password='pw-alice-1')
+        response = self.client.get(reverse('lesson_pdf', args=[plan.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f'lessonplan_{plan.pk}.', response['Content-Disposition'])
+
+        self.client.login(username='bob', password='pw-bob-1')
+        response = self.client.get(reverse('lesson_pdf', args=[plan.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class HistoryExportTests(TempDirsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('dave', password='pw-dave-1')
+        other = User.objects.create_user('erin', password='pw-erin-1')
+        archived = [self.make_plan(self.user, topic='Archived topic'), self.make_plan(other, topic='Not mine')]
+        archive.write_segment(archived)
+        with stats.suspended():
+            LessonPlan.objects.filter(pk__in=[p.pk for p in archived]).delete()
+        self.make_plan(self.user, topic='Live topic')
+        self.client.login(username='dave', password='pw-dave-1')
+
+    def export(self, **params):
+        response = self.client.get(reverse('lesson_history'), params)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_includes_archived_plans_of_user_only(self):
+        response, body = self.export()
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        text = body.decode('utf-8')
+        self.assertIn('Live topic', text)
+        self.assertIn('Archived topic', text)
+        self.assertNotIn('Not mine', text)
+
+    def test_gzip_only_when_requested(self):
+        response, body = self.export(gzip='1')
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn(b'Live topic', gzip.decompress(body))
+        for value in ('0', 'false', ''):
+            response, body = self.export(gzip=value)
+            self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+
+
+@unittest.skipUnless(similarity.available(), 'numpy and scipy are not installed')
+class SimilarityTests(TempDirsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('frank', password='pw-frank-1')
+
+    def save(self, plan=None, **fields):
+        """Create (or save) a plan and run its on_commit indexing."""
+        with self.captureOnCommitCallbacks(execute=True):
+            if plan is None:
+                return self.make_plan(self.user, **fields)
+            plan.save()
+            return plan
+
+    def rows(self):
+        return similarity._length('ids')
+
+    def test_suggestions_are_cut_to_limit(self):
+        for i in range(10):
+            self.save(topic=f'Photosynthesis in plants {i}')
+        self.client.login(username='frank', password='pw-frank-1')
+        response = self.client.get(reverse('similar_plans'), {'topic': 'photosynthesis plants'})
+        self.assertEqual(len(response.json()['results']), 5)
+
+    def test_only_text_changes_are_indexed_again(self):
+        plan = self.save(topic='Photosynthesis')
+        plan.duration = 60
+        self.save(plan)
+        self.assertEqual(self.rows(), 1)
+        plan.topic = plan.content = 'Volcanoes and lava'
+        self.save(plan)
+        self.assertEqual(self.rows(), 2)
+        # only the latest row of a plan is scored
+        self.assertEqual(similarity.query([('photosynthesis', '')], user_id=self.user.id)[0], [])
+        self.assertEqual([pk for pk, _ in similarity.query([('volcanoes lava', '')])[0]], [plan.pk])
+
+    def test_rebuild_keeps_plans_saved_meanwhile(self):
+        self.save(topic='Photosynthesis')
+        late = []
+        append = similarity._append
+
+        def append_and_save(plans, directory):
+            # a plan saved (and appended to the live index) while the staging index is built
+            if directory != similarity.index_dir() and not late:
+                late.append(self.save(topic='Volcanoes and lava'))
+            return append(plans, directory)
+
+        with mock.patch.object(similarity, '_append', side_effect=append_and_save):
+            similarity.rebuild(LessonPlan.objects.all())
+        self.assertEqual([pk for pk, _ in similarity.query([('volcanoes lava', '')])[0]], [late[0].pk])
+
+    def test_rebuild_after_interrupted_swap(self):
+        self.save(topic='Photosynthesis')
+        leftover = similarity.index_dir() + '.old'
+        os.makedirs(leftover)
+        open(os.path.join(leftover, 'ids.bin'), 'wb').close()
+        self.assertEqual(similarity.rebuild(LessonPlan.objects.all()), 1)
+        self.assertFalse(os.path.exists(leftover))
+
+    def test_index_errors_do_not_fail_saves(self):
+        with mock.patch.object(similarity, 'add_plans', side_effect=ValueError('truncated')):
+            with self.assertLogs('lesson_generator.signals', 'ERROR'):
+                plan = self.save(topic='Photosynthesis')
+        self.assertTrue(LessonPlan.objects.filter(pk=plan.pk).exists())
+
+
+class UsageStatsTests(TempDirsMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('carol', password='pw-carol-1')
+
+    def bucket(self, subject='Mathematics', grade='Grade 7'):
+        stat = PlanUsageStat.objects.filter(subject=subject, grade=grade).first()
+        return (stat.plan_count, stat.total_duration) if stat else None
+
+    def test_create_counts_plan(self):
+        self.make_plan(self.user, duration=40)
+        self.make_plan(self.user, topic='Decimals', duration=20)
+        self.assertEqual(self.bucket(), (2, 60))
+
+    def test_edit_moves_plan_to_new_bucket(self):
+        plan = self.make_plan(self.user, duration=40)
+        self.make_plan(self.user, topic='Decimals', duration=20)
+        plan.grade = 'Grade 8'
+        plan.save()
+        self.assertEqual(self.bucket(), (1, 20))
+        self.assertEqual(self.bucket(grade='Grade 8'), (1, 40))
+        # saving again without changes must not count it twice
+        plan.save()
+        self.assertEqual(self.bucket(grade='Grade 8'), (1, 40))
+
+    def test_delete_uncounts_plan(self):
+        plan = self.make_plan(self.user, duration=40)
+        self.make_plan(self.user, topic='Decimals', duration=20)
+        plan.delete()
+        self.assertEqual(self.bucket(), (1, 20))
+
+    def test_delete_never_goes_below_zero(self):
+        plan = self.make_plan(self.user, duration=40)
+        PlanUsageStat.objects.all().delete()
+        PlanUsageStat.objects.create(subject='Mathematics', grade='Grade 7', month=stats.month_of(plan.created))
+        plan.delete()
+        self.assertEqual(self.bucket(), (0, 0))
+
+    def test_archived_plans_stay_counted(self):
+        plans = [self.make_plan(self.user, topic=f'Topic {i}', duration=30) for i in range(3)]
+        archive.write_segment(plans)
+        with stats.suspended():
+            LessonPlan.objects.filter(pk__in=[p.pk for p in plans]).delete()
+        self.assertEqual(self.bucket(), (3, 90))
+        PlanUsageStat.objects.all().delete()
+        stats.rebuild()
+        self.assertEqual(self.bucket(), (3, 90))
+
+
+@override_settings(REPLICA_DATABASES=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    def run_request(self, method='get', cookies=None, view=None):
+        """Run ``view`` (default: record the read alias) behind the middleware."""
+        seen = []
+
+        def default_view(request):
+            seen.append(router.db_for_read(LessonPlan))
+            return HttpResponse()
+
+        request = getattr(RequestFactory(), method)('/home/')
+        request.COOKIES.update(cookies or {})
+        response = ReplicaPinningMiddleware(view or default_view)(request)
+        return response, seen
+
+    def test_get_reads_from_replica(self):
+        response, seen = self.run_request()
+        self.assertEqual(seen, ['replica'])
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_post_reads_from_primary_and_pins(self):
+        def view(request):
+            router.db_for_write(LessonPlan)
+            return HttpResponse()
+
+        response, _ = self.run_request('post', view=view)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        _, seen = self.run_request('post')
+        self.assertEqual(seen, ['default'])
+
+    def test_pin_cookie_forces_primary(self):
+        _, seen = self.run_request(cookies={PIN_COOKIE: '1'})
+        self.assertEqual(seen, ['default'])
+
+    def test_write_switches_rest_of_request_to_primary(self):
+        seen = []
+
+        def view(request):
+            seen.append(router.db_for_read(LessonPlan))
+            router.db_for_write(LessonPlan)
+            seen.append(router.db_for_read(LessonPlan))
+            return HttpResponse()
+
+        self.run_request(view=view)
+        self.assertEqual(seen, ['replica', 'default'])
+
+    def test_streamed_body_reads_from_replica(self):
+        def view(request):
+            return StreamingHttpResponse(router.db_for_read(LessonPlan) for _ in range(3))
+
+        response, _ = self.run_request(view=view)
+        self.assertEqual(b''.join(response.streaming_content), b'replicareplicareplica')
+        # outside the response the flag is off again
+        self.assertEqual(router.db_for_read(LessonPlan), 'default')
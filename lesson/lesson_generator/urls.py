@@ -7,10 +7,16 @@ urlpatterns = [
     path('login/', views.login_view, name='login'),
     path('logout/', views.logout_view, name='logout'),
     path('home/', views.index, name='home'),
+    path('home/generate/', views.generate_plan, name='generate_plan'),
+    path('home/similar/', views.similar_plans, name='similar_plans'),
     path('lesson/<int:pk>/pdf/', views.lesson_pdf, name='lesson_pdf'),
     path('lesson/<int:pk>/docx/', views.lesson_docx, name='lesson_docx'),
+    path('history/export/', views.lesson_history, name='lesson_history'),
     path('forgot-password/', views.forgot_password, name='forgot_password'),
     path('reset-password/', views.reset_password, name='reset_password'),
+    path('staff/stats/', views.usage_stats, name='usage_stats'),
+    path('staff/profiles/', views.profile_list, name='profile_list'),
+    path('staff/profiles/<str:name>/', views.profile_download, name='profile_download'),
     # optional: keep a separate generate/ if you prefer
     # path('generate/', views.generate, name='generate'),
 ]
\ No newline at end of file
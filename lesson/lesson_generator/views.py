@@ -1,16 +1,30 @@
 from django.shortcuts import render, redirect
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django.views.decorators.http import require_POST
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .forms import RegisterForm
-from .models import LessonPlan
-from django.http import HttpResponse, Http404
+from .models import LessonPlan, PlanUsageStat
+from . import archive, similarity
+from django.http import HttpResponse, Http404, FileResponse, JsonResponse, StreamingHttpResponse
+from django.db import IntegrityError, transaction
+from django.db.models import Sum
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.admin.views.decorators import staff_member_required
+import csv
 import io
+import json
+import pstats
+import zlib
 from django.utils.crypto import get_random_string
 from django.core.mail import send_mail
 from django.utils import timezone
 from .models import PasswordResetCode
 from django.contrib.auth.models import User
+from .middleware import list_profiles, profile_path, profile_max_files
 
 
 def infer_student_requirements(topic: str) -> str:
@@ -157,6 +171,46 @@ def _make_docx_bytes(text: str, lp=None) -> bytes:
     return buffer.getvalue()
 
 
+def _export_bytes(lp, fmt: str) -> bytes:
+    """Return 'pdf' or 'docx' bytes for the plan, reusing a cached render of identical content.
+
+    The cache key is hashed from the plan's current fields rather than the
+    stored input_hash, so a plan edited after creation never gets a stale file.
+    Raises ImportError if the renderer library is not installed.
+    """
+    digest = LessonPlan.compute_input_hash(
+        lp.subject, lp.grade, lp.topic, lp.duration, lp.content, lp.teacher_actions, lp.student_requirements
+    )
+    key = f'lessonplan-export:{fmt}:{digest}'
+    data = cache.get(key)
+    if data is not None:
+        return data
+    if fmt == 'pdf':
+        data = _make_pdf_bytes(lp.content)
+    else:
+        data = _make_docx_bytes(lp.content, lp)
+    cache.set(key, data, getattr(settings, 'EXPORT_CACHE_TIMEOUT', 60 * 60 * 24))
+    return data
+
+
+def _get_or_create_plan(request, **fields):
+    """Return (plan, created) for the submitted fields, reusing an identical saved plan.
+
+    Double submits and retries carry the same inputs, so they match on the
+    input hash; the (user, input_hash) unique constraint settles concurrent ones.
+    """
+    input_hash = LessonPlan.compute_input_hash(**fields)
+    lp = LessonPlan.objects.filter(user=request.user, input_hash=input_hash).first()
+    if lp is not None:
+        return lp, False
+    try:
+        with transaction.atomic():
+            return LessonPlan.objects.create(user=request.user, **fields), True
+    except IntegrityError:
+        # a concurrent submit with the same inputs won the race
+        return LessonPlan.objects.get(user=request.user, input_hash=input_hash), False
+
+
 def _infer_student_requirements(topic: str) -> str:
     """Return a short string listing suggested student requirements based on topic keywords.
 
@@ -199,6 +253,67 @@ def _infer_student_requirements(topic: str) -> str:
             seen.add(s)
     return ', '.join(dedup)
 
+def _build_lesson_plan_text(subject, grade, topic, duration, teacher_actions, student_requirements) -> str:
+    """Return the lesson plan body, including the teacher actions section."""
+    return (
+        f"Subject: {subject}\n"
+        f"Grade: {grade}\n"
+        f"Topic: {topic}\n"
+        f"Duration: {duration} minutes\n\n"
+        "Objective:\n"
+        f"- Students will learn the basics of {topic}.\n\n"
+        "Materials:\n"
+        "- Whiteboard, markers, worksheets.\n"
+        f"- Student requirements: {student_requirements or 'None specified.'}\n\n"
+        "Activities (with teacher actions):\n"
+        "1. Introduction (10 min): Hook + objectives.\n"
+        f"   Teacher actions: {teacher_actions or 'Introduce topic, set objectives.'}\n\n"
+        "2. Teaching & Modelling:\n"
+        f"   Teacher actions: {teacher_actions or 'Explain and model examples.'}\n\n"
+        "3. Guided Practice:\n"
+        f"   Teacher actions: {teacher_actions or 'Guide students through examples.'}\n\n"
+        "4. Independent Practice:\n"
+        f"   Teacher actions: {teacher_actions or 'Monitor and support.'}\n\n"
+        "5. Assessment & Plenary:\n"
+        f"   Teacher actions: {teacher_actions or 'Give quick quiz and recap.'}\n\n"
+        "Homework:\n"
+        f"- Practice problems on {topic}."
+    )
+
+
+def _lesson_fields_from_post(post):
+    """Validate the generate form and return (LessonPlan fields, error message)."""
+    subject = post.get("subject", "").strip()
+    grade = post.get("grade", "").strip()
+    topic = post.get("topic", "").strip()
+    duration = post.get("duration", "").strip()
+    teacher_actions = post.get("teacher_actions", "").strip()
+    student_requirements = post.get("student_requirements", "").strip()
+
+    if not (subject and grade and topic and duration):
+        return None, "All fields are required."
+    try:
+        duration_int = int(duration)
+    except ValueError:
+        return None, "Duration must be a number."
+
+    return {
+        "subject": subject,
+        "grade": grade,
+        "topic": topic,
+        "duration": duration_int,
+        "content": _build_lesson_plan_text(subject, grade, topic, duration_int, teacher_actions, student_requirements),
+        "teacher_actions": teacher_actions,
+        "student_requirements": student_requirements,
+    }, None
+
+
+def _generated_message(created):
+    if created:
+        return "Lesson plan generated and saved."
+    return "An identical lesson plan was already saved; showing that one."
+
+
 @login_required
 def index(request):
     lesson_plan_text = None
@@ -206,103 +321,108 @@ def index(request):
     # ensure these locals exist for GET requests
     topic = ''
     student_requirements = ''
-    teacher_actions = ''
-    duration_int = None
     if request.method == "POST":
-        subject = request.POST.get("subject", "").strip()
-        grade = request.POST.get("grade", "").strip()
         topic = request.POST.get("topic", "").strip()
-        duration = request.POST.get("duration", "").strip()
-        teacher_actions = request.POST.get("teacher_actions", "").strip()
         student_requirements = request.POST.get("student_requirements", "").strip()
 
-        if not (subject and grade and topic and duration):
-            messages.error(request, "All fields are required.")
+        fields, error = _lesson_fields_from_post(request.POST)
+        if error:
+            messages.error(request, error)
         else:
-            try:
-                duration_int = int(duration)
-            except ValueError:
-                duration_int = None
-                messages.error(request, "Duration must be a number.")
-
-            if duration_int is not None:
-                # Build plan and include teacher actions section
-                lesson_plan_text = (
-                    f"Subject: {subject}\n"
-                    f"Grade: {grade}\n"
-                    f"Topic: {topic}\n"
-                    f"Duration: {duration_int} minutes\n\n"
-                    "Objective:\n"
-                    f"- Students will learn the basics of {topic}.\n\n"
-                    "Materials:\n"
-                    "- Whiteboard, markers, worksheets.\n"
-                    f"- Student requirements: {student_requirements or 'None specified.'}\n\n"
-                    "Activities (with teacher actions):\n"
-                    "1. Introduction (10 min): Hook + objectives.\n"
-                    f"   Teacher actions: {teacher_actions or 'Introduce topic, set objectives.'}\n\n"
-                    "2. Teaching & Modelling:\n"
-                    f"   Teacher actions: {teacher_actions or 'Explain and model examples.'}\n\n"
-                    "3. Guided Practice:\n"
-                    f"   Teacher actions: {teacher_actions or 'Guide students through examples.'}\n\n"
-                    "4. Independent Practice:\n"
-                    f"   Teacher actions: {teacher_actions or 'Monitor and support.'}\n\n"
-                    "5. Assessment & Plenary:\n"
-                    f"   Teacher actions: {teacher_actions or 'Give quick quiz and recap.'}\n\n"
-                    "Homework:\n"
-                    f"- Practice problems on {topic}."
-                )
-
-                lp = LessonPlan.objects.create(
-                    user=request.user,
-                    subject=subject,
-                    grade=grade,
-                    topic=topic,
-                    duration=duration_int,
-                    content=lesson_plan_text,
-                    teacher_actions=teacher_actions,
-                    student_requirements=student_requirements,
-                )
-                lesson_plan_id = lp.id
-                messages.success(request, "Lesson plan generated and saved.")
-
-                # If the user clicked Generate & Download PDF/DOCX, return the generated file immediately
-                if 'download_pdf' in request.POST:
-                    try:
-                        pdf_bytes = _make_pdf_bytes(lesson_plan_text)
-                        response = HttpResponse(pdf_bytes, content_type='application/pdf')
-                        response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.pdf"'
-                        response['Content-Length'] = str(len(pdf_bytes))
-                        return response
-                    except ImportError:
-                        # Fallback: return plain text file with only the generated part
-                        txt = lesson_plan_text or ''
-                        txt_bytes = txt.encode('utf-8')
-                        response = HttpResponse(txt_bytes, content_type='text/plain; charset=utf-8')
-                        response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.txt"'
-                        response['Content-Length'] = str(len(txt_bytes))
-                        return response
-
-                if 'download_docx' in request.POST:
-                    try:
-                        docx_bytes = _make_docx_bytes(lesson_plan_text, lp)
-                        response = HttpResponse(docx_bytes, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
-                        response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.docx"'
-                        response['Content-Length'] = str(len(docx_bytes))
-                        return response
-                    except ImportError:
-                        # Fallback to plain text attachment
-                        txt = lesson_plan_text or ''
-                        txt_bytes = txt.encode('utf-8')
-                        response = HttpResponse(txt_bytes, content_type='text/plain; charset=utf-8')
-                        response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.txt"'
-                        response['Content-Length'] = str(len(txt_bytes))
-                        return response
+            lesson_plan_text = fields["content"]
+            lp, created = _get_or_create_plan(request, **fields)
+            lesson_plan_id = lp.id
+            messages.success(request, _generated_message(created))
+
+            # If the user clicked Generate & Download PDF/DOCX, return the generated file immediately
+            if 'download_pdf' in request.POST:
+                try:
+                    pdf_bytes = _export_bytes(lp, 'pdf')
+                    response = HttpResponse(pdf_bytes, content_type='application/pdf')
+                    response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.pdf"'
+                    response['Content-Length'] = str(len(pdf_bytes))
+                    return response
+                except ImportError:
+                    # Fallback: return plain text file with only the generated part
+                    txt = lesson_plan_text or ''
+                    txt_bytes = txt.encode('utf-8')
+                    response = HttpResponse(txt_bytes, content_type='text/plain; charset=utf-8')
+                    response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.txt"'
+                    response['Content-Length'] = str(len(txt_bytes))
+                    return response
+
+            if 'download_docx' in request.POST:
+                try:
+                    docx_bytes = _export_bytes(lp, 'docx')
+                    response = HttpResponse(docx_bytes, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
+                    response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.docx"'
+                    response['Content-Length'] = str(len(docx_bytes))
+                    return response
+                except ImportError:
+                    # Fallback to plain text attachment
+                    txt = lesson_plan_text or ''
+                    txt_bytes = txt.encode('utf-8')
+                    response = HttpResponse(txt_bytes, content_type='text/plain; charset=utf-8')
+                    response['Content-Disposition'] = f'attachment; filename="lessonplan_{lp.id}.txt"'
+                    response['Content-Length'] = str(len(txt_bytes))
+                    return response
 
     recent_plans = LessonPlan.objects.filter(user=request.user).order_by("-created")[:10]
     # If student_requirements wasn't provided, infer from topic for display
     display_student_requirements = student_requirements if (student_requirements is not None and student_requirements != '') else (infer_student_requirements(topic) if topic else '')
     return render(request, "index.html", {"lesson_plan": lesson_plan_text, "recent_plans": recent_plans, "lesson_plan_id": lesson_plan_id, "student_requirements": display_student_requirements})
 
+
+@login_required
+@require_POST
+def generate_plan(request):
+    """AJAX counterpart of ``index``: save (or reuse) the plan and return only its HTML.
+
+    Responds with JSON containing the rendered generated-plan block and the
+    card for the recent plans list, so the page does not have to be reloaded.
+    """
+    fields, error = _lesson_fields_from_post(request.POST)
+    if error:
+        return JsonResponse({"error": error}, status=400)
+    lp, created = _get_or_create_plan(request, **fields)
+    return JsonResponse({
+        "id": lp.id,
+        "created": created,
+        "message": _generated_message(created),
+        "plan_html": render_to_string("generated_plan.html", {"lesson_plan": lp.content, "lesson_plan_id": lp.id}, request=request),
+        "card_html": render_to_string("plan_card.html", {"lp": lp}, request=request),
+    })
+
+@login_required
+def similar_plans(request):
+    """Return the user's saved plans most similar to ``?subject=&topic=`` as JSON.
+
+    Needs numpy and scipy; without them the list is always empty.
+    """
+    subject = request.GET.get("subject", "").strip()
+    topic = request.GET.get("topic", "").strip()
+    if not topic or not similarity.available():
+        return JsonResponse({"results": [], "available": similarity.available()})
+
+    limit = 5
+    matches = similarity.query([(topic, subject)], user_id=request.user.id, limit=limit)[0]
+    # rows of deleted or archived plans are still in the index; only return live ones
+    plans = LessonPlan.objects.filter(user=request.user, pk__in=[pk for pk, _ in matches]).in_bulk()
+    matches = [(pk, score) for pk, score in matches if pk in plans][:limit]
+    results = [
+        {
+            "id": pk,
+            "subject": plans[pk].subject,
+            "grade": plans[pk].grade,
+            "topic": plans[pk].topic,
+            "score": round(score, 3),
+            "pdf_url": reverse("lesson_pdf", args=[pk]),
+            "docx_url": reverse("lesson_docx", args=[pk]),
+        }
+        for pk, score in matches
+    ]
+    return JsonResponse({"results": results, "available": True})
+
 def welcome(request):
     return render(request, 'welcome.html')
 
@@ -337,20 +457,92 @@ def logout_view(request):
     return redirect('welcome')
 
 
+def _get_plan_or_404(request, pk):
+    """Return the user's LessonPlan from the table, falling back to the archive."""
+    try:
+        return LessonPlan.objects.get(pk=pk, user=request.user)
+    except LessonPlan.DoesNotExist:
+        pass
+    lp = archive.load_plan(pk)
+    if lp is None or lp.user_id != request.user.id:
+        raise Http404("Lesson plan not found")
+    return lp
+
+
+HISTORY_FIELDS = ['id', 'created', 'subject', 'grade', 'topic', 'duration', 'teacher_actions', 'student_requirements', 'content']
+HISTORY_CHUNK_SIZE = 500
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for streaming csv.writer output."""
+
+    def write(self, value):
+        return value
+
+
+def _history_rows(user):
+    """Yield the user's plans as tuples of HISTORY_FIELDS, table first, then the archive."""
+    rows = LessonPlan.objects.filter(user=user).order_by('pk').values_list(*HISTORY_FIELDS)
+    yield from rows.iterator(chunk_size=HISTORY_CHUNK_SIZE)
+    for lp in archive.iter_user_plans(user.id):
+        yield tuple(getattr(lp, name) for name in HISTORY_FIELDS)
+
+
+def _history_lines(user, fmt):
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(HISTORY_FIELDS)
+        for row in _history_rows(user):
+            yield writer.writerow([value.isoformat() if name == 'created' else value for name, value in zip(HISTORY_FIELDS, row)])
+    else:
+        for row in _history_rows(user):
+            record = dict(zip(HISTORY_FIELDS, row))
+            record['created'] = record['created'].isoformat()
+            yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@login_required
+def lesson_history(request):
+    """Stream all of the user's lesson plans as CSV or JSONL (``?format=``), optionally gzipped (``?gzip=1``).
+
+    Rows are read with a chunked iterator and written as they arrive, so memory
+    use stays flat however many plans the user has.
+    """
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in ('csv', 'jsonl'):
+        raise Http404("Unknown export format")
+    lines = _history_lines(request.user, fmt)
+    filename = f'lesson_history.{fmt}'
+    content_type = 'text/csv; charset=utf-8' if fmt == 'csv' else 'application/x-ndjson; charset=utf-8'
+    if request.GET.get('gzip', '').lower() in ('1', 'true'):
+        lines = _gzip_stream(lines)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(lines, content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
 @login_required
 def lesson_pdf(request, pk):
     """Generate a PDF for the requested LessonPlan and return it as attachment.
 
-    If reportlab is not installed, redirect back with an instructive message.
+    If reportlab is not installed, fall back to a plain-text attachment.
     """
-    try:
-        lp = LessonPlan.objects.get(pk=pk, user=request.user)
-    except LessonPlan.DoesNotExist:
-        raise Http404("Lesson plan not found")
+    lp = _get_plan_or_404(request, pk)
 
     try:
-        from reportlab.lib.pagesizes import letter
-        from reportlab.pdfgen import canvas
+        pdf_bytes = _export_bytes(lp, 'pdf')
     except ImportError:
         # Fallback: return plain text attachment with the lesson plan content
         txt = lp.content or ''
@@ -360,24 +552,6 @@ def lesson_pdf(request, pk):
         response['Content-Length'] = str(len(txt_bytes))
         return response
 
-    buffer = io.BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    textobject = p.beginText(40, 750)
-    textobject.setFont("Helvetica", 11)
-    for line in lp.content.splitlines():
-        # Basic text wrapping for very long lines
-        if len(line) <= 90:
-            textobject.textLine(line)
-        else:
-            # naive wrap: split into chunks of ~90 chars
-            for i in range(0, len(line), 90):
-                textobject.textLine(line[i:i+90])
-    p.drawText(textobject)
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    pdf_bytes = buffer.getvalue()
-
     response = HttpResponse(pdf_bytes, content_type='application/pdf')
     response['Content-Disposition'] = f'attachment; filename="lessonplan_{pk}.pdf"'
     response['Content-Length'] = str(len(pdf_bytes))
@@ -389,15 +563,12 @@ def lesson_pdf(request, pk):
 def lesson_docx(request, pk):
     """Generate a .docx (Word) document for the requested LessonPlan and return it as attachment.
 
-    If python-docx is not installed, redirect back with an instructive message.
+    If python-docx is not installed, fall back to a plain-text attachment.
     """
-    try:
-        lp = LessonPlan.objects.get(pk=pk, user=request.user)
-    except LessonPlan.DoesNotExist:
-        raise Http404("Lesson plan not found")
+    lp = _get_plan_or_404(request, pk)
 
     try:
-        from docx import Document
+        docx_bytes = _export_bytes(lp, 'docx')
     except ImportError:
         # Fallback: return plain text attachment with the lesson plan content
         txt = lp.content or ''
@@ -407,27 +578,70 @@ def lesson_docx(request, pk):
         response['Content-Length'] = str(len(txt_bytes))
         return response
 
-    doc = Document()
-    doc.add_heading(f'Lesson Plan: {lp.topic}', level=1)
-    # Add metadata lines as paragraphs for better Word formatting
-    doc.add_paragraph(f'Subject: {lp.subject}')
-    doc.add_paragraph(f'Grade: {lp.grade}')
-    doc.add_paragraph(f'Duration: {lp.duration} minutes')
-    doc.add_paragraph('')
-    for line in lp.content.splitlines():
-        # skip empty lines to avoid excessive spacing
-        if line.strip() == '':
-            doc.add_paragraph('')
-        else:
-            doc.add_paragraph(line)
-
-    buffer = io.BytesIO()
-    doc.save(buffer)
-    buffer.seek(0)
-    docx_bytes = buffer.getvalue()
-
     response = HttpResponse(docx_bytes, content_type='application/vnd.openxmlformats-officedocument.wordprocessingml.document')
     response['Content-Disposition'] = f'attachment; filename="lessonplan_{pk}.docx"'
     response['Content-Length'] = str(len(docx_bytes))
     return response
 
+
+@staff_member_required
+def profile_list(request):
+    """List request profiles captured by ProfilingMiddleware (staff only)."""
+    return render(request, 'profiles.html', {'profiles': list_profiles(), 'max_files': profile_max_files()})
+
+
+@staff_member_required
+def profile_download(request, name):
+    """Download a stored profile as a pstats file, or as text with ``?format=txt``."""
+    path = profile_path(name)
+    if path is None:
+        raise Http404("Profile not found")
+
+    if request.GET.get('format') == 'txt':
+        out = io.StringIO()
+        stats = pstats.Stats(path, stream=out)
+        sort = request.GET.get('sort', 'cumulative')
+        if sort not in ('cumulative', 'tottime', 'calls', 'ncalls'):
+            sort = 'cumulative'
+        stats.sort_stats(sort).print_stats(60)
+        return HttpResponse(out.getvalue(), content_type='text/plain; charset=utf-8')
+
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='application/octet-stream')
+
+
+@staff_member_required
+def usage_stats(request):
+    """Plan counts per subject, grade and month, read from the PlanUsageStat summary.
+
+    Optional filters: ``subject``, ``grade``. Add ``?format=json`` for the API form.
+    """
+    rows = PlanUsageStat.objects.filter(plan_count__gt=0).order_by('-month', 'subject', 'grade')
+    subject = request.GET.get('subject', '').strip()
+    grade = request.GET.get('grade', '').strip()
+    if subject:
+        rows = rows.filter(subject=subject)
+    if grade:
+        rows = rows.filter(grade=grade)
+
+    buckets = [
+        {
+            'subject': r.subject,
+            'grade': r.grade,
+            'month': r.month.strftime('%Y-%m'),
+            'plans': r.plan_count,
+            'average_duration': round(r.average_duration, 1),
+        }
+        for r in rows
+    ]
+    totals = rows.aggregate(plans=Sum('plan_count'), duration=Sum('total_duration'))
+    total_plans = totals['plans'] or 0
+    summary = {
+        'plans': total_plans,
+        'average_duration': round((totals['duration'] or 0) / total_plans, 1) if total_plans else 0,
+    }
+
+    if request.GET.get('format') == 'json':
+        return JsonResponse({'totals': summary, 'buckets': buckets})
+    return render(request, 'usage_stats.html', {
+        'buckets': buckets, 'totals': summary, 'subject': subject, 'grade': grade,
+    })
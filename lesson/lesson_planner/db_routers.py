@@ -0,0 +1,86 @@
+"""Primary/replica database routing.
+
+Reads of the read-heavy lesson plan tables go to one of the aliases in
+settings.REPLICA_DATABASES; every write and every other read goes to
+``default``. Replica reads are only enabled inside requests handled by
+ReplicaPinningMiddleware, so management commands (archiving, stats rebuilds)
+always see the primary.
+
+Read-your-writes: as soon as a request writes, the rest of that request reads
+from the primary, and the client gets a short-lived cookie that keeps its
+following requests on the primary until the replicas have caught up.
+"""
+import contextvars
+import random
+
+from django.conf import settings
+
+PIN_COOKIE = 'db_pin'
+
+_use_replica = contextvars.ContextVar('use_replica', default=False)
+_wrote = contextvars.ContextVar('wrote', default=False)
+
+
+class PrimaryReplicaRouter:
+    read_models = {'lesson_generator.lessonplan', 'lesson_generator.planusagestat'}
+
+    def db_for_read(self, model, **hints):
+        if not _use_replica.get() or model._meta.label_lower not in self.read_models:
+            return 'default'
+        replicas = getattr(settings, 'REPLICA_DATABASES', [])
+        return random.choice(replicas) if replicas else 'default'
+
+    def db_for_write(self, model, **hints):
+        _use_replica.set(False)
+        _wrote.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold copies of the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas receive the schema together with the data
+        return db == 'default'
+
+
+class ReplicaPinningMiddleware:
+    """Enable replica reads for safe requests from clients that have not just written."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        pinned = PIN_COOKIE in request.COOKIES
+        replica_token = _use_replica.set(request.method in ('GET', 'HEAD') and not pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get():
+                response.set_cookie(
+                    PIN_COOKIE, '1',
+                    max_age=getattr(settings, 'REPLICA_PIN_SECONDS', 15),
+                    httponly=True, samesite='Lax',
+                )
+            if response.streaming:
+                # the body is produced after we return (e.g. the history export)
+                response.streaming_content = self._route_stream(response.streaming_content, _use_replica.get())
+        finally:
+            _use_replica.reset(replica_token)
+            _wrote.reset(wrote_token)
+        return response
+
+    def _route_stream(self, content, use_replica):
+        """Yield ``content`` with the request's replica setting active while each chunk is made."""
+        chunks = iter(content)
+        while True:
+            token = _use_replica.set(use_replica)
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            finally:
+                # a write while streaming keeps the remaining chunks on the primary
+                use_replica = _use_replica.get()
+                _use_replica.reset(token)
+            yield chunk
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +47,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "lesson_planner.db_routers.ReplicaPinningMiddleware",
+    "lesson_generator.middleware.ProfilingMiddleware",  # staff-only, ?profile=1 or X-Profile: 1
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -63,6 +66,22 @@ DATABASES = {
     }
 }
 
+# Read replicas (see lesson_planner/db_routers.py). Every alias other than
+# "default" receives lesson plan reads. Set LESSON_PLANNER_SQLITE_REPLICA=1 to
+# try it locally with a second SQLite file kept in sync by
+# `python manage.py sync_sqlite_replica --interval 5`.
+if os.environ.get("LESSON_PLANNER_SQLITE_REPLICA") == "1":
+    DATABASES["replica"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.replica.sqlite3",
+        "TEST": {"MIRROR": "default"},
+    }
+
+REPLICA_DATABASES = [alias for alias in DATABASES if alias != "default"]
+DATABASE_ROUTERS = ["lesson_planner.db_routers.PrimaryReplicaRouter"]
+# How long a client that just wrote keeps reading from the primary
+REPLICA_PIN_SECONDS = 15
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -126,3 +145,13 @@ WSGI_APPLICATION = "lesson_planner.wsgi.application"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# On-demand request profiles (see lesson_generator.middleware.ProfilingMiddleware)
+PROFILE_DIR = BASE_DIR / "profiles"
+PROFILE_MAX_FILES = 50
+
+# Cold storage for archived lesson plans (see manage.py archive_plans)
+ARCHIVE_DIR = BASE_DIR / "archive"
+
+# On-disk TF-IDF index for similar-plan suggestions (needs numpy + scipy)
+SIMILARITY_DIR = BASE_DIR / "similarity"